@@ -1,8 +1,29 @@
+import hashlib
+import logging
+import time
+from logging.handlers import RotatingFileHandler
+
 import streamlit as st
-from survey_analyzer import query_analyzer
+from survey_analyzer import SUMMARY_ERROR, query_analyzer
 
 st.set_page_config(page_title="Survey Data Analyzer", layout="wide")
 
+
+@st.cache_resource
+def configure_logging():
+    """
+    Send backend logs to a rotating file. Cached so reruns don't add handlers.
+    """
+    handler = RotatingFileHandler("survey_analyzer.log", maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    for name in ("survey_analyzer", "llm_cache", "survey_stats"):
+        logger = logging.getLogger(name)
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+configure_logging()
+
 # --- Page Title and Description ---
 st.title("🩺 Medical Survey Data Analyzer")
 st.markdown("""
@@ -27,6 +48,10 @@ selected_question = st.sidebar.selectbox(
     "Choose a sample question or write your own below:",
     [""] + sample_questions
 )
+always_llm_summary = st.sidebar.checkbox(
+    "Always use LLM summary",
+    help="Small aggregate results are normally described instantly without a second LLM call."
+)
 
 
 # --- User Input ---
@@ -38,6 +63,43 @@ else:
 
 
 # --- Submit Button and Processing ---
+RESULT_TTL_SECONDS = 600
+
+
+def show_result(summary, sql_query, df):
+    """
+    Render an answer. A streamed summary is displayed as it arrives.
+
+    Returns:
+        str: The full summary text.
+    """
+    st.subheader("💡 Summary")
+    if isinstance(summary, str):
+        st.markdown(summary)
+    else:
+        # Show the LLM summary as it is generated
+        placeholder = st.empty()
+        text = ""
+        for chunk in summary:
+            text += chunk
+            placeholder.markdown(text)
+        summary = text
+
+    with st.expander("Show Details"):
+        st.subheader("🔍 Generated SQL Query")
+        st.code(sql_query, language="sql")
+
+        if df is not None:
+            st.subheader("📊 Raw Data")
+            st.dataframe(df)
+        else:
+            st.info("No data frame was generated from the query.")
+    return summary
+
+
+# Answers from this session, so widget reruns redisplay them instead of querying again
+results = st.session_state.setdefault("results", {})
+
 if st.button("Analyze Data", type="primary"):
     if not api_key:
         st.error("⚠️ Please enter your Google API Key in the sidebar to proceed.")
@@ -46,25 +108,31 @@ if st.button("Analyze Data", type="primary"):
     else:
         with st.spinner("Analyzing data... This may take a moment."):
             try:
-                # Call the backend logic
-                summary, sql_query, df = query_analyzer(user_question, api_key)
+                result_key = (
+                    user_question,
+                    hashlib.sha256(api_key.encode()).hexdigest(),
+                    always_llm_summary,
+                )
+                cached = results.get(result_key)
+                if cached is not None and time.time() - cached[0] < RESULT_TTL_SECONDS:
+                    summary, sql_query, df = cached[1]
+                else:
+                    # Call the backend logic
+                    summary, sql_query, df = query_analyzer(
+                        user_question, api_key, always_llm_summary, stream=True
+                    )
 
                 # --- Display Results ---
-                st.subheader("💡 Summary")
-                st.markdown(summary)
-
-                with st.expander("Show Details"):
-                    st.subheader("🔍 Generated SQL Query")
-                    st.code(sql_query, language="sql")
-
-                    if df is not None:
-                        st.subheader("📊 Raw Data")
-                        st.dataframe(df)
-                    else:
-                        st.info("No data frame was generated from the query.")
+                summary = show_result(summary, sql_query, df)
+                st.session_state["last_result"] = (summary, sql_query, df)
+                # Failed summaries are retried on the next click instead of being memoised
+                if df is not None and SUMMARY_ERROR not in summary:
+                    results[result_key] = (time.time(), (summary, sql_query, df))
 
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
+elif "last_result" in st.session_state:
+    show_result(*st.session_state["last_result"])
 
 # --- Instructions ---
 st.markdown("""
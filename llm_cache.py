@@ -0,0 +1,276 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # the semantic layer is optional; exact-match caching still works
+    faiss = None
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB_PATH = "llm_cache.db"
+CACHE_TTL_SECONDS = 24 * 60 * 60
+MEMORY_CACHE_SIZE = 256
+
+SEMANTIC_INDEX_PATH = "semantic_cache.faiss"
+SEMANTIC_ENTRIES_PATH = "semantic_cache.json"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+# Cosine similarity at or above which a cached answer is reused outright
+SEMANTIC_HIT_THRESHOLD = 0.92
+# Between this and the hit threshold the LLM is asked whether the questions are equivalent
+SEMANTIC_CHECK_THRESHOLD = 0.80
+# Past this many entries the flat float32 index is replaced by an 8-bit scalar
+# quantized one (384 bytes per vector instead of 1536). Its inner products stay
+# close enough to the exact ones for the thresholds above.
+SEMANTIC_COMPRESS_AT = 1000
+# Neighbours returned per lookup, so a stale nearest entry doesn't hide a fresh one
+SEMANTIC_SEARCH_K = 4
+
+# In-process layer in front of the SQLite table: key -> (ts, sql, df_blob, summary).
+# Streamlit sessions run on separate threads, so it is only touched under _memory_lock.
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def make_key(question: str, model_name: str, db_version: float) -> str:
+    """
+    Build the exact-match cache key for a question answered by a given model
+    against a given version (modification time) of the survey database.
+    """
+    return hashlib.sha256(f"{question.strip()}|{model_name}|{db_version}".encode()).hexdigest()
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS llm_cache ("
+        "key TEXT PRIMARY KEY, sql TEXT, df BLOB, summary TEXT, ts REAL)"
+    )
+    return conn
+
+
+def _remember(key: str, row: tuple):
+    with _memory_lock:
+        _memory[key] = row
+        _memory.move_to_end(key)
+        if len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def lookup(key: str, ttl: float = CACHE_TTL_SECONDS):
+    """
+    Look up a previously answered question.
+
+    Args:
+        key (str): Cache key from make_key().
+        ttl (float): Maximum age of a cached answer, in seconds.
+
+    Returns:
+        tuple: (summary, sql_query, result_df) on a hit, or None on a miss.
+    """
+    min_ts = time.time() - ttl
+    with _memory_lock:
+        row = _memory.get(key)
+        if row is not None and row[0] > min_ts:
+            _memory.move_to_end(key)
+        else:
+            row = None
+    if row is None:
+        with closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT ts, sql, df, summary FROM llm_cache WHERE key = ? AND ts > ?",
+                (key, min_ts),
+            ).fetchone()
+        if row is None:
+            return None
+        _remember(key, row)
+
+    _, sql_query, blob, summary = row
+    # Rows hold the compressed Parquet bytes; a DataFrame is decoded once per hit
+    return summary, sql_query, pd.read_parquet(io.BytesIO(blob))
+
+
+def store(key: str, summary: str, sql_query: str, result_df: pd.DataFrame):
+    """
+    Persist a successful answer so the same question can skip the LLM next time.
+    """
+    buf = io.BytesIO()
+    result_df.to_parquet(buf, compression="zstd", compression_level=3)
+    row = (time.time(), sql_query, buf.getvalue(), summary)
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, sql, df, summary, ts) VALUES (?, ?, ?, ?, ?)",
+            (key, row[1], row[2], row[3], row[0]),
+        )
+    _remember(key, row)
+
+
+# -----------------------------
+# Semantic layer: maps question embeddings to exact-match cache keys
+# -----------------------------
+@dataclass
+class CacheEntry:
+    key: str
+    question: str
+
+
+_semantic_lock = threading.Lock()
+_semantic_index = None
+_semantic_entries = []
+_encoder_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """
+    Load the sentence-transformer once. A failed load is cached as None, which
+    disables the semantic layer instead of retrying the download on every request.
+    """
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning("Semantic cache disabled, could not load %s: %s", EMBEDDING_MODEL, e)
+        return None
+
+
+def _load_semantic_index():
+    global _semantic_index, _semantic_entries
+    if _semantic_index is not None:
+        return _semantic_index
+    if os.path.exists(SEMANTIC_INDEX_PATH) and os.path.exists(SEMANTIC_ENTRIES_PATH):
+        _semantic_index = faiss.read_index(SEMANTIC_INDEX_PATH)
+        with open(SEMANTIC_ENTRIES_PATH, encoding="utf-8") as f:
+            _semantic_entries = [CacheEntry(**entry) for entry in json.load(f)]
+    else:
+        _semantic_index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        _semantic_entries = []
+    return _semantic_index
+
+
+def _compress_index(flat_index):
+    """
+    Re-encode every vector of a flat index as 8-bit codes.
+    """
+    vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+    index = faiss.IndexScalarQuantizer(
+        EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+    )
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def embed_texts(texts: list):
+    """
+    Embed several texts with the semantic cache's sentence-transformer.
+
+    Returns:
+        numpy.ndarray: A (len(texts), EMBEDDING_DIM) array of normalized float32
+                       vectors, or None when faiss/sentence-transformers are not
+                       installed or the model could not be loaded.
+    """
+    if faiss is None:
+        return None
+    with _encoder_lock:
+        encoder = _get_encoder()
+    if encoder is None:
+        return None
+    return encoder.encode([text.strip() for text in texts], normalize_embeddings=True).astype("float32")
+
+
+def embed(question: str):
+    """
+    Embed a question for the semantic cache.
+
+    Returns:
+        numpy.ndarray: A (1, EMBEDDING_DIM) normalized float32 vector, or None
+                       when the semantic layer is unavailable (see embed_texts()).
+    """
+    return embed_texts([question])
+
+
+def _save_semantic_index(index):
+    faiss.write_index(index, SEMANTIC_INDEX_PATH)
+    with open(SEMANTIC_ENTRIES_PATH, "w", encoding="utf-8") as f:
+        json.dump([asdict(entry) for entry in _semantic_entries], f)
+
+
+def semantic_lookup(embedding) -> list:
+    """
+    Find the closest previously answered questions.
+
+    Args:
+        embedding: Vector returned by embed(), or None.
+
+    Returns:
+        list: Up to SEMANTIC_SEARCH_K (similarity, CacheEntry) pairs, most similar
+              first; empty if the semantic cache is empty or unavailable.
+    """
+    if embedding is None:
+        return []
+    with _semantic_lock:
+        index = _load_semantic_index()
+        if index.ntotal == 0:
+            return []
+        scores, ids = index.search(embedding, SEMANTIC_SEARCH_K)
+        return [
+            (float(score), _semantic_entries[i])
+            for score, i in zip(scores[0], ids[0])
+            if i >= 0
+        ]
+
+
+def semantic_add(embedding, key: str, question: str):
+    """
+    Register an answered question so paraphrases of it can reuse the cached answer.
+    A question that is already indexed keeps its vector and points to the new key.
+    """
+    global _semantic_index
+    if embedding is None:
+        return
+    with _semantic_lock:
+        index = _load_semantic_index()
+        for entry in _semantic_entries:
+            if entry.question.strip() == question.strip():
+                entry.key = key
+                break
+        else:
+            index.add(embedding)
+            _semantic_entries.append(CacheEntry(key=key, question=question))
+            if isinstance(index, faiss.IndexFlat) and index.ntotal >= SEMANTIC_COMPRESS_AT:
+                index = _semantic_index = _compress_index(index)
+        _save_semantic_index(index)
+
+
+def semantic_remove(key: str):
+    """
+    Drop the questions whose cached answer has expired or is stale.
+    """
+    if faiss is None:
+        return
+    with _semantic_lock:
+        index = _load_semantic_index()
+        positions = [i for i, entry in enumerate(_semantic_entries) if entry.key == key]
+        if not positions:
+            return
+        # Removal shifts later ids down, matching the deletions from the entry list
+        index.remove_ids(np.array(positions, dtype="int64"))
+        for i in reversed(positions):
+            del _semantic_entries[i]
+        _save_semantic_index(index)
@@ -1,55 +1,51 @@
+import asyncio
+import difflib
+import json
+import logging
+import os
+import numpy as np
 import pandas as pd
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from langchain_google_genai import GoogleGenerativeAI
-from langchain_community.utilities import SQLDatabase
-from langchain_experimental.sql import SQLDatabaseChain
 from langchain.prompts import PromptTemplate
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+import sqlglot
+from sqlglot import exp
+import llm_cache
+import survey_stats
 
-def query_analyzer(question: str, api_key: str):
-    """
-    Takes a user's question in natural language, converts it to a SQL query,
-    executes it against the survey database, and returns a summarized answer.
-
-    Args:
-        question (str): The user's question about the survey data.
-        api_key (str): The Google API key for the Gemini model.
+try:
+    import connectorx as cx
+except ImportError:  # fall back to pandas + SQLAlchemy
+    cx = None
 
-    Returns:
-        tuple: A tuple containing the final summary (str), the cleaned SQL query (str),
-               and the resulting pandas DataFrame. Or (error_message, None, None) on failure.
-    """
-    # -----------------------------
-    # 1️⃣ Setup SQLite connection
-    # -----------------------------
-    try:
-        engine = create_engine("sqlite:///survey_results.db")
-        db = SQLDatabase(engine)
-    except Exception as e:
-        error_msg = f"Error connecting to database: {e}"
-        print(error_msg)
-        return error_msg, None, None
+logger = logging.getLogger(__name__)
 
-    # -----------------------------
-    # 2️⃣ Initialize Gemini LLM
-    # -----------------------------
-    try:
-        llm = GoogleGenerativeAI(
-            google_api_key=api_key,
-            model="gemini-2.0-flash" # Using a standard model name
-        )
-    except Exception as e:
-        error_msg = f"Error initializing LLM. Please check your API key. Details: {e}"
-        print(error_msg)
-        return error_msg, None, None
+MODEL_NAME = "gemini-2.0-flash"
+DB_PATH = "survey_results.db"
+# The survey database is only ever read: open it read-only with a shared page cache
+DB_URL = f"sqlite:///file:{DB_PATH}?mode=ro&cache=shared&uri=true"
+# Read-only connections never journal, so journal_mode/synchronous are left alone
+_SQLITE_PRAGMAS = (
+    "PRAGMA query_only=1",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
 
+_PREFIX_RE = re.compile(r"^(Question:|SQLQuery:)\s*", re.IGNORECASE)
+_SELECT_RE = re.compile(r"SELECT\s.+", re.IGNORECASE | re.DOTALL)
+_FENCE_TABLE = str.maketrans("", "", "`")
+# Compound input such as "What was the average score? How many improved?"
+_SUBQUESTION_RE = re.compile(r"(?<=\?)\s+")
+# Numbers and pre/post must agree before a similar question's cached answer is reused
+_KEY_TERMS_RE = re.compile(r"\d+(?:\.\d+)?|\b(?:pre|post)(?=\b|-|test)")
 
-    # -----------------------------
-    # 3️⃣ Custom SQL prompt
-    # -----------------------------
-    custom_prompt = PromptTemplate(
-        input_variables=["table_info", "input"],
-        template="""
+SQL_PROMPT = PromptTemplate(
+    input_variables=["table_info", "input"],
+    template="""
 You are an expert SQLite query generator.
 
 Database schema:
@@ -63,88 +59,676 @@ Important rules:
   • PRET1 → PRET15 = pre-test answers for questions 1 → 15.
   • POSTT1 → POSTT15 = post-test answers for questions 1 → 15.
   • PRET_SCORE and POSTT_SCORE store total scores.
-- To check correctness, compare PRETn or POSTTn against Sheet1.Answer where Question_no = n.
+- To check correctness, compare PRETn or POSTTn against Sheet1.Answer where Question_no = 'Tn'.
 - Always return syntactically valid SQLite queries.
 - Do not invent table names or columns.
 - Respond only with the SQL query (no text, no markdown).
+- If the question asks for several independent results, respond instead with a JSON array
+  of SQL query strings, one per part.
 
 Question: {input}
 SQLQuery:
 """
+)
+
+# Static instructions come first so the shared prefix can be reused by Gemini's prompt caching
+SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["question", "data"],
+    template="""
+You are a medical data assistant.
+Summarize and explain the trends in natural language. Answer the question subtly.
+Keep your answers concise but do not miss important details.
+Do not give medical advice, only describe the data.
+Large results are given as HEAD and TAIL samples followed by STATS for all rows.
+
+The doctor asked: {question}
+Here are the retrieved results (CSV):
+{data}
+"""
+)
+
+# The SQL prompt shows only the survey questions (PRESn/POSTSn) most similar to the user's question
+SCHEMA_MAX_SURVEY_QUESTIONS = 3
+SCHEMA_MIN_SIMILARITY = 0.25
+
+_SHEET1_SCHEMA = """CREATE TABLE "Sheet1" (
+  "Question_no" TEXT,  -- 'T1'..'T15' for test questions, 'S1'..'S12' for survey questions
+  "Question" TEXT,
+  "Answer" TEXT  -- correct answer text of test questions
+)"""
+
+_SHEET2_CORE_COLUMNS = [
+    ('"userid" INTEGER', ""),
+    (", ".join(f'"PRET{i}"' for i in range(1, 16)) + " TEXT", "pre-test answers to questions T1..T15"),
+    (", ".join(f'"POSTT{i}"' for i in range(1, 16)) + " TEXT", "post-test answers to questions T1..T15"),
+    ('"PRET_SCORE" INTEGER', "pre-test total score"),
+    ('"POSTT_SCORE" INTEGER', "post-test total score"),
+]
+
+# Generated SQL is validated locally; a rejected query gets one regeneration
+SQL_ATTEMPTS = 2
+KNOWN_TABLES = ("Sheet1", "Sheet2")
+RESULT_ROW_LIMIT = 1000
+# Generated queries run on this many threads, matching the engine's connection pool
+SQL_MAX_WORKERS = 4
+_SQL_EXECUTOR = ThreadPoolExecutor(max_workers=SQL_MAX_WORKERS, thread_name_prefix="survey-sql")
+
+# Results longer than this are sampled before being sent to the summarizer
+SUMMARY_MAX_ROWS = 40
+# Prefix of the message returned (or appended to a streamed summary) when summarization fails
+SUMMARY_ERROR = "Error during summarization"
+
+# Aggregate results up to this size are described without a second LLM call
+LOCAL_SUMMARY_MAX_CELLS = 12
+LOCAL_SUMMARY_MAX_ROWS = 3
+_AGGREGATE_RE = re.compile(r"\b(AVG|SUM|COUNT|MIN|MAX)\s*\(", re.IGNORECASE)
+
+
+def _render_schema(survey_questions: list) -> str:
+    """
+    Render a compact schema for the SQL prompt.
+
+    Args:
+        survey_questions (list): (n, question text) pairs whose PRESn/POSTSn
+            survey columns should be included.
+    """
+    columns = _SHEET2_CORE_COLUMNS + [
+        (f'"PRES{n}", "POSTS{n}" TEXT', f"survey answers before/after the workshop: {text}")
+        for n, text in survey_questions
+    ]
+    lines = []
+    for i, (declaration, comment) in enumerate(columns):
+        line = declaration + ("," if i < len(columns) - 1 else "")
+        lines.append(f"{line}  -- {comment}" if comment else line)
+    return _SHEET1_SCHEMA + '\n\nCREATE TABLE "Sheet2" (\n  ' + "\n  ".join(lines) + "\n)"
+
+
+@lru_cache(maxsize=1)
+def _get_survey_catalog():
+    """
+    Load the survey questions (Sheet1 rows S1..S12) and embed them once.
+    """
+    engine = _get_engine()
+    sheet1 = pd.read_sql_query(
+        "SELECT Question_no, Question FROM Sheet1 WHERE Question_no LIKE 'S%'", engine
+    )
+    survey_questions = [(int(no[1:]), text) for no, text in zip(sheet1["Question_no"], sheet1["Question"])]
+    vectors = llm_cache.embed_texts([text for _, text in survey_questions])
+    return survey_questions, vectors
+
+
+def _filtered_table_info(question_embedding) -> str:
+    """
+    Build the schema for the SQL prompt, keeping only the survey questions
+    that are semantically close to the user's question.
+    """
+    survey_questions, vectors = _get_survey_catalog()
+    scores = vectors @ question_embedding[0]
+    top = np.argsort(-scores)[:SCHEMA_MAX_SURVEY_QUESTIONS]
+    chosen = [survey_questions[i] for i in sorted(top) if scores[i] >= SCHEMA_MIN_SIMILARITY]
+    return _render_schema(chosen)
+
+
+@lru_cache(maxsize=1)
+def _table_info() -> dict:
+    """
+    Read each known table's (column name, type) pairs once with PRAGMA table_info.
+    """
+    with _get_engine().connect() as conn:
+        return {
+            table: [(row[1], row[2]) for row in conn.execute(text(f'PRAGMA table_info("{table}")'))]
+            for table in KNOWN_TABLES
+        }
+
+
+@lru_cache(maxsize=1)
+def _cached_schema() -> str:
+    """
+    Full schema for the SQL prompt, used when it cannot be filtered to the question.
+    """
+    return "\n\n".join(
+        f'CREATE TABLE "{table}" (\n  '
+        + ",\n  ".join(f'"{name}" {type_}' for name, type_ in columns)
+        + "\n)"
+        for table, columns in _table_info().items()
+    )
+
+
+def _table_columns() -> dict:
+    """
+    Map each known table (lower-cased) to its lower-cased column names.
+    """
+    return {
+        table.lower(): {name.lower() for name, _ in columns}
+        for table, columns in _table_info().items()
+    }
+
+
+def _is_quoted_value(column: exp.Column, known: set, text_columns: set) -> bool:
+    """
+    True for an unknown double-quoted name used as the value in an equality or
+    IN test against a TEXT column (Question_no = "T5"), which SQLite reads as a
+    string. Names close to a real column are typos and are left to be rejected.
+    """
+    if column.table or not column.this.quoted or column.name.lower() in known:
+        return False
+    parent = column.parent
+    if isinstance(parent, exp.In) and parent.this is not column:
+        other = parent.this
+    elif isinstance(parent, (exp.EQ, exp.NEQ)):
+        other = parent.right if parent.left is column else parent.left
+    else:
+        return False
+    return (
+        isinstance(other, exp.Column)
+        and other.name.lower() in text_columns
+        and not difflib.get_close_matches(column.name.lower(), known, n=1, cutoff=0.8)
+    )
+
+
+def _validate_sql(sql_query: str) -> str:
+    """
+    Parse generated SQL before it reaches the database. Only a single SELECT
+    over Sheet1/Sheet2 and their columns is accepted. A missing FROM is added
+    when the referenced columns identify the table, and a LIMIT is added when absent.
+
+    Returns:
+        str: The validated, re-rendered SQL query.
+
+    Raises:
+        ValueError: If the query is invalid, with a message meant to be fed back to the LLM.
+    """
+    try:
+        statements = [tree for tree in sqlglot.parse(sql_query, dialect="sqlite") if tree is not None]
+    except sqlglot.errors.ParseError as e:
+        raise ValueError(f"syntax error: {e.errors[0]['description'] if e.errors else e}") from None
+    if len(statements) != 1:
+        raise ValueError(f"expected exactly one SQL statement, got {len(statements)}")
+    tree = statements[0]
+    if not isinstance(tree, (exp.Select, exp.Union)):
+        raise ValueError("only SELECT queries are allowed")
+
+    table_columns = _table_columns()
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    unknown_tables = sorted({
+        table.name for table in tree.find_all(exp.Table)
+        if table.name.lower() not in table_columns and table.name.lower() not in ctes
+    })
+    if unknown_tables:
+        raise ValueError(f"unknown table(s) {', '.join(unknown_tables)}; use only {', '.join(KNOWN_TABLES)}")
+
+    known_columns = set().union(*table_columns.values())
+    aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    if not ctes:
+        # Repair string values written in double quotes locally instead of asking for a new query
+        text_columns = {
+            name.lower() for columns in _table_info().values() for name, type_ in columns if type_.upper() == "TEXT"
+        }
+        for column in list(tree.find_all(exp.Column)):
+            if _is_quoted_value(column, known_columns | aliases, text_columns):
+                column.replace(exp.Literal.string(column.name))
+    columns = {column.name for column in tree.find_all(exp.Column)}
+    unknown_columns = sorted(c for c in columns if c.lower() not in known_columns | aliases)
+    if unknown_columns and not ctes:
+        raise ValueError(f"unknown column(s) {', '.join(unknown_columns)}")
+
+    if isinstance(tree, exp.Select) and not (tree.args.get("from_") or tree.args.get("from")) and columns:
+        owners = [
+            table for table in KNOWN_TABLES
+            if {c.lower() for c in columns} <= table_columns[table.lower()]
+        ]
+        if len(owners) != 1:
+            raise ValueError("missing FROM clause")
+        tree = tree.from_(owners[0])
+
+    if not tree.args.get("limit"):
+        tree = tree.limit(RESULT_ROW_LIMIT)
+    return tree.sql(dialect="sqlite")
+
+
+def _summarize_payload(df: pd.DataFrame, max_rows: int = SUMMARY_MAX_ROWS) -> str:
+    """
+    Render query results compactly for the summarization prompt: the full
+    table as CSV when it is small, otherwise head/tail samples plus describe().
+    """
+    if len(df) <= max_rows:
+        return df.to_csv(index=False)
+    return (
+        "HEAD:\n" + df.head(20).to_csv(index=False)
+        + "\nTAIL:\n" + df.tail(10).to_csv(index=False)
+        + "\nSTATS:\n" + df.describe(include="all").to_csv()
+    )
+
+
+def _render_local_summary(df: pd.DataFrame) -> str:
+    """
+    Describe a small aggregate result without calling the LLM.
+    """
+    def fmt(value):
+        return f"{value:,.2f}" if isinstance(value, float) else str(value)
+
+    lines = [
+        ", ".join(f"**{column}**: {fmt(value)}" for column, value in row.items())
+        for row in df.to_dict("records")
+    ]
+    if not lines:
+        return "The query returned no rows."
+    return f"The query computed {', '.join(map(str, df.columns))}.\n\n" + "\n\n".join(lines)
+
+
+def _stream_summary(llm, prompt: str, on_complete):
+    """
+    Yield the summary as Gemini generates it, then hand the full text to
+    on_complete() so it can be cached.
+    """
+    chunks = []
+    try:
+        for chunk in llm.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        error_msg = f"{SUMMARY_ERROR}: {e}"
+        logger.error(error_msg)
+        yield f"\n\n{error_msg}"
+        return
+    final_answer = "".join(chunks)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("💡 LLM's Answer:\n%s", final_answer)
+    on_complete(summary=final_answer)
+
+
+def _db_version() -> float:
+    """
+    Modification time of the survey database, so cached answers expire when it changes.
+    """
+    try:
+        return os.stat(DB_PATH).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _store_answer(cache_key: str, embedding, question: str, summary: str, sql_query: str, result_df: pd.DataFrame):
+    try:
+        llm_cache.store(cache_key, summary, sql_query, result_df)
+        llm_cache.semantic_add(embedding, cache_key, question)
+    except Exception as e:
+        logger.warning("Could not cache the answer: %s", e)
+
+
+def _read_sql(sql_query: str, engine) -> pd.DataFrame:
+    """
+    Execute a SELECT and return the result as a DataFrame. connectorx streams
+    Arrow batches straight into pandas; pandas + SQLAlchemy is the fallback for
+    anything connectorx cannot run.
+    """
+    if cx is not None and sql_query.lstrip()[:6].upper() == "SELECT":
+        try:
+            return cx.read_sql(f"sqlite://{os.path.abspath(DB_PATH)}", sql_query, return_type="pandas")
+        except Exception as e:
+            logger.info("connectorx could not run the query, using SQLAlchemy: %s", e)
+    return pd.read_sql_query(sql_query, engine)
+
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink query results: integer columns (ids, scores) are downcast to the
+    smallest integer type and repetitive text columns (answer options,
+    demographics) become categoricals.
+    """
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if pd.api.types.is_integer_dtype(column.dtype):
+            df.isetitem(i, pd.to_numeric(column, downcast="integer"))
+        elif (column.dtype == object or pd.api.types.is_string_dtype(column.dtype)) and (
+            len(column) > 1 and column.nunique() <= len(column) // 2
+        ):
+            df.isetitem(i, column.astype("category"))
+    return df
+
+
+@lru_cache(maxsize=1)
+def _get_engine():
+    """
+    Create the SQLAlchemy engine once per process.
+    """
+    engine = create_engine(
+        DB_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=SQL_MAX_WORKERS,
+        max_overflow=0,
     )
 
-    sql_chain = SQLDatabaseChain.from_llm(
-        llm=llm,
-        db=db,
-        verbose=True,
-        return_sql=True,
-        prompt=custom_prompt
+    @event.listens_for(engine, "connect")
+    def _tune_connection(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for pragma in _SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+@lru_cache(maxsize=4)
+def _get_llm(api_key: str):
+    """
+    Create the Gemini client once per API key.
+    """
+    return GoogleGenerativeAI(
+        google_api_key=api_key,
+        model=MODEL_NAME
     )
 
+
+def _key_terms(question: str) -> list:
+    """
+    Terms that change the answer while barely moving the embedding
+    ("top 5" vs "top 10", "pre-test" vs "post-test").
+    """
+    return sorted(_KEY_TERMS_RE.findall(question.lower()))
+
+
+async def _semantic_cache_hit(llm, question: str, embedding, db_version: float):
+    """
+    Return the cached answer of the nearest equivalent, previously asked question,
+    or None. Neighbours whose answer has expired or is stale are dropped from the
+    semantic index.
+    """
+    loop = asyncio.get_running_loop()
+    matches = await loop.run_in_executor(None, llm_cache.semantic_lookup, embedding)
+    for similarity, entry in matches:
+        if similarity < llm_cache.SEMANTIC_CHECK_THRESHOLD:
+            break
+        if _key_terms(entry.question) != _key_terms(question):
+            continue
+        # Entries keyed against an older version of the database are stale
+        cached = None
+        if entry.key == llm_cache.make_key(entry.question, MODEL_NAME, db_version):
+            cached = await loop.run_in_executor(None, llm_cache.lookup, entry.key)
+        if cached is None:
+            await loop.run_in_executor(None, llm_cache.semantic_remove, entry.key)
+            continue
+        if similarity >= llm_cache.SEMANTIC_HIT_THRESHOLD or await _same_question(llm, question, entry.question):
+            logger.info("⚡ Semantic cache hit (%.2f): %s", similarity, entry.question)
+            return cached
+    return None
+
+
+async def _same_question(llm, question: str, cached_question: str) -> bool:
+    """
+    Ask the LLM whether two questions request the same data from the survey.
+    Used for near-miss semantic cache matches before reusing an answer.
+    """
+    try:
+        verdict = await llm.ainvoke(
+            "Do these two questions about a medical survey database ask for exactly "
+            "the same data? Answer only 'yes' or 'no'.\n"
+            f"1. {question}\n2. {cached_question}"
+        )
+    except Exception as e:
+        logger.warning("Equivalence check failed: %s", e)
+        return False
+    return verdict.strip().lower().startswith("yes")
+
+
+def clean_sql(sql: str) -> str:
+    """
+    Clean Gemini's output so only raw SQL is returned.
+    """
+    sql = sql.strip()
+    if sql[:6].upper() == "SELECT":
+        return sql
+    if "`" in sql:
+        sql = sql.translate(_FENCE_TABLE).strip()
+        if sql[:3].lower() == "sql":
+            sql = sql[3:]
+    match = _SELECT_RE.search(sql)
+    if match:
+        return match.group(0).strip()
+    return _PREFIX_RE.sub("", sql).strip()
+
+
+def _parse_sql_response(raw_sql: str) -> list:
+    """
+    Split the SQL generator's response into cleaned queries: a JSON array
+    for multi-part questions, otherwise a single query.
+    """
+    text = raw_sql.strip().translate(_FENCE_TABLE).strip()
+    if text[:4].lower() == "json":
+        text = text[4:].lstrip()
+    if text.startswith("["):
+        try:
+            queries = json.loads(text)
+        except json.JSONDecodeError:
+            queries = None
+        if isinstance(queries, list) and queries and all(isinstance(q, str) for q in queries):
+            return [clean_sql(query) for query in queries]
+    return [clean_sql(raw_sql)]
+
+
+def _join_queries(queries: list) -> str:
+    if len(queries) == 1:
+        return queries[0]
+    return "\n\n".join(f"-- query {i}\n{query}" for i, query in enumerate(queries, 1))
+
+
+def _merge_results(frames: list) -> pd.DataFrame:
+    """
+    Combine the results of a multi-part question, labelling each row with the
+    query (as numbered in _join_queries) that produced it.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    labelled = {f"query {i}": df for i, df in enumerate(frames, 1)}
+    return pd.concat(labelled, names=["query"]).reset_index(level=0).reset_index(drop=True)
+
+
+def query_analyzer(question: str, api_key: str, always_llm_summary: bool = False, stream: bool = False):
+    """
+    Takes a user's question in natural language, converts it to a SQL query,
+    executes it against the survey database, and returns a summarized answer.
+
+    Args:
+        question (str): The user's question about the survey data.
+        api_key (str): The Google API key for the Gemini model.
+        always_llm_summary (bool): Summarize with the LLM even when the result is a
+            small aggregate that can be described locally.
+        stream (bool): Return an LLM-written summary as an iterator of text chunks
+            so it can be displayed while it is generated.
+
+    Returns:
+        tuple: A tuple containing the final summary (str), the cleaned SQL query (str),
+               and the resulting pandas DataFrame. Or (error_message, None, None) on failure.
+               With stream=True the summary may instead be an iterator of str chunks;
+               cached and locally written summaries are still returned as str.
+    """
+    return asyncio.run(aquery_analyzer(question, api_key, always_llm_summary, stream))
+
+
+async def aquery_analyzer(question: str, api_key: str, always_llm_summary: bool = False, stream: bool = False):
+    """
+    Async version of query_analyzer(). A question made of several sentences
+    ending in "?" is split and each part is answered concurrently.
+
+    Returns:
+        tuple: Same as query_analyzer(). For compound questions the summaries and
+               SQL queries are joined and the DataFrames are stacked with a
+               "question" column identifying the part each row answers, and the
+               summary is always a str.
+    """
+    sub_questions = [q.strip() for q in _SUBQUESTION_RE.split(question.strip()) if q.strip()]
+    if len(sub_questions) < 2:
+        return await _answer_question(question, api_key, always_llm_summary, stream)
+
+    results = await asyncio.gather(
+        *[_answer_question(q, api_key, always_llm_summary, False) for q in sub_questions]
+    )
+
+    summary = "\n\n".join(f"**{q}**\n\n{answer}" for q, (answer, _, _) in zip(sub_questions, results))
+    sql_query = "\n\n".join(sql for _, sql, _ in results if sql) or None
+    frames = {q: df for q, (_, _, df) in zip(sub_questions, results) if df is not None}
+    result_df = None
+    if frames:
+        result_df = pd.concat(frames, names=["question"]).reset_index(level=0).reset_index(drop=True)
+    return summary, sql_query, result_df
+
+
+async def _answer_question(question: str, api_key: str, always_llm_summary: bool, stream: bool):
     # -----------------------------
-    # 4️⃣ Utility to clean SQL
+    # 0️⃣ Serve repeated questions from the response cache
     # -----------------------------
-    def clean_sql(sql: str) -> str:
-        """
-        Clean Gemini's output so only raw SQL is returned.
-        """
-        sql = re.sub(r"^(Question:|SQLQuery:)\s*", "", sql, flags=re.IGNORECASE).strip()
-        sql = sql.replace("```", "").replace("sql", "").strip()
-        match = re.search(r"(SELECT\s.+)", sql, re.IGNORECASE | re.DOTALL)
-        if match:
-            return match.group(1).strip()
-        return sql
+    # Answers summarized locally and by the LLM are cached separately, and
+    # answers computed from an older version of the database are never reused
+    db_version = _db_version()
+    cache_key = llm_cache.make_key(
+        question,
+        f"{MODEL_NAME}|llm-summary" if always_llm_summary else MODEL_NAME,
+        db_version,
+    )
+    try:
+        cached = llm_cache.lookup(cache_key)
+    except Exception as e:
+        logger.warning("Response cache unavailable: %s", e)
+        cached = None
+    if cached is not None:
+        logger.info("⚡ Cache hit for question: %s", question)
+        return cached
 
     # -----------------------------
-    # 5️⃣ Generate, Clean, and Execute Query
+    # 1️⃣ Setup SQLite connection
     # -----------------------------
-    print(f"🩺 Doctor's Question: {question}")
+    try:
+        engine = _get_engine()
+    except Exception as e:
+        error_msg = f"Error connecting to database: {e}"
+        logger.error(error_msg)
+        return error_msg, None, None
 
-    # Step 1: Generate SQL
+    # -----------------------------
+    # 2️⃣ Initialize Gemini LLM
+    # -----------------------------
     try:
-        raw_sql_result = sql_chain.invoke({"query": question})
-        raw_sql = raw_sql_result["result"] if isinstance(raw_sql_result, dict) else raw_sql_result
-        print(f"\n📘 Generated SQL (raw):\n{raw_sql}")
+        llm = _get_llm(api_key)
     except Exception as e:
-        error_msg = f"Error during SQL generation: {e}"
-        print(error_msg)
+        error_msg = f"Error initializing LLM. Please check your API key. Details: {e}"
+        logger.error(error_msg)
         return error_msg, None, None
 
-    # Step 2: Clean SQL
-    sql_query = clean_sql(raw_sql)
-    print(f"\n📘 Cleaned SQL:\n{sql_query}")
+    # -----------------------------
+    # 3️⃣ Generate, Clean, and Execute Query
+    # -----------------------------
+    logger.info("🩺 Doctor's Question: %s", question)
 
-    # Step 3: Execute SQL
+    # Step 0: Answer common questions straight from the precomputed survey statistics
+    embedding = None
     try:
-        result_df = pd.read_sql_query(sql_query, engine)
-        print("\n📊 Retrieved Data:\n", result_df.head())
+        intent = await asyncio.get_running_loop().run_in_executor(
+            None, survey_stats.answer_intent, question, engine, DB_PATH
+        )
     except Exception as e:
-        error_msg = f"SQL Execution Error: {e}\nAttempted Query: {sql_query}"
-        print(f"\n⚠️ {error_msg}")
-        return error_msg, sql_query, None
-
-    # Step 4: Summarize results with LLM
-    summary_prompt = PromptTemplate(
-        input_variables=["question", "data"],
-        template="""
-You are a medical data assistant.
-The doctor asked: {question}
-Here are the retrieved results:
-{data}
+        logger.warning("Intent shortcut failed, generating SQL instead: %s", e)
+        intent = None
 
-Summarize and explain the trends in natural language. Answer the question subtly.
-Keep your answers concise but do not miss important details.
-Do not give medical advice, only describe the data.
-"""
-    )
-    try:
-        final_answer = llm.invoke(summary_prompt.format(
-            question=question,
-            data=result_df.to_string()
-        ))
-        print(f"\n💡 LLM's Answer:\n{final_answer}")
+    if intent is not None:
+        intent_name, result_df = intent
+        sql_query = f"-- Answered from precomputed survey statistics ({intent_name})"
+        logger.info("⚡ Matched intent: %s", intent_name)
+    else:
+        # Step 0b: Reuse the answer to an equivalent, previously asked question.
+        # The semantic index holds only answers summarized in the default mode.
+        loop = asyncio.get_running_loop()
+        try:
+            embedding = await loop.run_in_executor(None, llm_cache.embed, question)
+            if not always_llm_summary:
+                cached = await _semantic_cache_hit(llm, question, embedding, db_version)
+        except Exception as e:
+            logger.warning("Semantic cache unavailable: %s", e)
+        if cached is not None:
+            return cached
+
+        # Step 1: Generate SQL, with a schema trimmed to the question when embeddings are available
+        table_info = None
+        if embedding is not None:
+            try:
+                table_info = await loop.run_in_executor(None, _filtered_table_info, embedding)
+            except Exception as e:
+                logger.warning("Could not filter the schema, using the full schema: %s", e)
+        prompt_question = question
+        for _ in range(SQL_ATTEMPTS):
+            try:
+                raw_sql = await llm.ainvoke(SQL_PROMPT.format(
+                    table_info=table_info or _cached_schema(),
+                    input=prompt_question
+                ))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📘 Generated SQL (raw):\n%s", raw_sql)
+            except Exception as e:
+                error_msg = f"Error during SQL generation: {e}"
+                logger.error(error_msg)
+                return error_msg, None, None
+
+            # Step 2: Clean and validate SQL; a rejected query is sent back to the LLM once
+            queries = _parse_sql_response(raw_sql)
+            sql_query = _join_queries(queries)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📘 Cleaned SQL:\n%s", sql_query)
+            try:
+                queries = [_validate_sql(query) for query in queries]
+                sql_query = _join_queries(queries)
+                break
+            except ValueError as e:
+                error_msg = f"Invalid SQL: {e}\nAttempted Query: {sql_query}"
+                logger.warning("⚠️ %s", error_msg)
+                prompt_question = f"{question}\nPrevious attempt failed: {e}. Fix it."
+        else:
+            return error_msg, sql_query, None
+
+        # Step 3: Execute SQL; the queries of a multi-part question run concurrently
+        try:
+            loop = asyncio.get_running_loop()
+            frames = await asyncio.gather(
+                *[loop.run_in_executor(_SQL_EXECUTOR, _read_sql, query, engine) for query in queries]
+            )
+            result_df = _compact_dtypes(_merge_results(frames))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📊 Retrieved Data:\n%s", result_df.head())
+        except Exception as e:
+            error_msg = f"SQL Execution Error: {e}\nAttempted Query: {sql_query}"
+            logger.error("⚠️ %s", error_msg)
+            return error_msg, sql_query, None
+
+    # Step 4: Summarize results, locally for small aggregates, otherwise with the LLM.
+    # Merged multi-query results are padded with NaN, so they always go to the LLM.
+    index_embedding = None if always_llm_summary else embedding
+    if (
+        not always_llm_summary
+        and result_df.size <= LOCAL_SUMMARY_MAX_CELLS
+        and len(result_df) <= LOCAL_SUMMARY_MAX_ROWS
+        and (intent is not None or (len(queries) == 1 and _AGGREGATE_RE.search(sql_query)))
+    ):
+        final_answer = _render_local_summary(result_df)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("💡 Local Answer:\n%s", final_answer)
+        await asyncio.get_running_loop().run_in_executor(
+            None, _store_answer, cache_key, index_embedding, question, final_answer, sql_query, result_df
+        )
         return final_answer, sql_query, result_df
+
+    try:
+        # Render the table off the event loop so concurrent sub-questions keep progressing
+        data = await asyncio.get_running_loop().run_in_executor(None, _summarize_payload, result_df)
+        prompt = SUMMARY_PROMPT.format(question=question, data=data)
+        if stream:
+            on_complete = partial(_store_answer, cache_key, index_embedding, question, sql_query=sql_query, result_df=result_df)
+            return _stream_summary(llm, prompt, on_complete), sql_query, result_df
+        final_answer = await llm.ainvoke(prompt)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("💡 LLM's Answer:\n%s", final_answer)
     except Exception as e:
-        error_msg = f"Error during summarization: {e}"
-        print(error_msg)
+        error_msg = f"{SUMMARY_ERROR}: {e}"
+        logger.error(error_msg)
         return error_msg, sql_query, result_df
+
+    await asyncio.get_running_loop().run_in_executor(
+        None, _store_answer, cache_key, index_embedding, question, final_answer, sql_query, result_df
+    )
+    return final_answer, sql_query, result_df
@@ -0,0 +1,271 @@
+import os
+import re
+from functools import lru_cache
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # the kernels still run as plain Python/NumPy
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+N_QUESTIONS = 15
+PRE_COLUMNS = [f"PRET{i}" for i in range(1, N_QUESTIONS + 1)]
+POST_COLUMNS = [f"POSTT{i}" for i in range(1, N_QUESTIONS + 1)]
+QUESTION_NOS = [f"T{i}" for i in range(1, N_QUESTIONS + 1)]
+
+
+# -----------------------------
+# Kernels over int8-encoded answers (one row per participant, one column per question).
+# Compiled serially: they run once per database version on request threads, where
+# Numba's parallel threading layer hangs interpreter shutdown.
+# -----------------------------
+@njit(cache=True)
+def score_rows(responses, answers):
+    out = np.empty(responses.shape[0], dtype=np.int64)
+    for i in range(responses.shape[0]):
+        total = 0
+        for j in range(responses.shape[1]):
+            if responses[i, j] == answers[j]:
+                total += 1
+        out[i] = total
+    return out
+
+
+@njit(cache=True)
+def improvement(pre, post, answers):
+    out = np.empty(pre.shape[0], dtype=np.int64)
+    for i in range(pre.shape[0]):
+        delta = 0
+        for j in range(pre.shape[1]):
+            if post[i, j] == answers[j]:
+                delta += 1
+            if pre[i, j] == answers[j]:
+                delta -= 1
+        out[i] = delta
+    return out
+
+
+@njit(cache=True)
+def correct_per_question(responses, answers):
+    out = np.empty(responses.shape[1], dtype=np.int64)
+    for j in range(responses.shape[1]):
+        total = 0
+        for i in range(responses.shape[0]):
+            if responses[i, j] == answers[j]:
+                total += 1
+        out[j] = total
+    return out
+
+
+def load_survey(engine) -> SimpleNamespace:
+    """
+    Load the test answers and encode every distinct answer text as an int8
+    code, so correctness is a code comparison against the answer key. Missing
+    responses are encoded as -1 and never match.
+    """
+    sheet1 = pd.read_sql_query("SELECT Question_no, Answer FROM Sheet1", engine)
+    sheet2 = pd.read_sql_query(
+        f"SELECT userid, {', '.join(PRE_COLUMNS + POST_COLUMNS)} FROM Sheet2", engine
+    )
+    answers = sheet1.set_index("Question_no")["Answer"].reindex(QUESTION_NOS)
+
+    n = len(sheet2)
+    values = np.concatenate([
+        sheet2[PRE_COLUMNS].to_numpy(object).ravel(),
+        sheet2[POST_COLUMNS].to_numpy(object).ravel(),
+        answers.to_numpy(object),
+    ])
+    codes, vocabulary = pd.factorize(values)
+    if len(vocabulary) > np.iinfo(np.int8).max:
+        raise ValueError(f"Too many distinct answers to encode as int8: {len(vocabulary)}")
+    codes = codes.astype(np.int8)
+    size = n * N_QUESTIONS
+    answer_codes = codes[2 * size:]
+    # An unknown answer key must not match missing responses
+    answer_codes[answer_codes < 0] = np.iinfo(np.int8).min
+
+    return SimpleNamespace(
+        userid=sheet2["userid"].to_numpy(),
+        pre=codes[:size].reshape(n, N_QUESTIONS),
+        post=codes[size:2 * size].reshape(n, N_QUESTIONS),
+        answers=answer_codes,
+    )
+
+
+@lru_cache(maxsize=1)
+def _precompute(engine, db_mtime: float) -> SimpleNamespace:
+    # db_mtime is only part of the cache key: a modified database file gets recomputed
+    survey = load_survey(engine)
+    survey.pre_correct = survey.pre == survey.answers[None, :]
+    survey.post_correct = survey.post == survey.answers[None, :]
+    survey.pre_score = score_rows(survey.pre, survey.answers)
+    survey.post_score = score_rows(survey.post, survey.answers)
+    survey.delta = improvement(survey.pre, survey.post, survey.answers)
+    survey.pre_question_correct = correct_per_question(survey.pre, survey.answers)
+    survey.post_question_correct = correct_per_question(survey.post, survey.answers)
+    return survey
+
+
+def precomputed(engine, db_path: str) -> SimpleNamespace:
+    """
+    Return the encoded answers together with derived per-participant and
+    per-question statistics, computed once and refreshed only when the
+    database file changes.
+
+    Args:
+        engine: SQLAlchemy engine for the survey database.
+        db_path (str): Path of the database file, used to detect changes.
+
+    Returns:
+        SimpleNamespace: userid, pre/post answer codes, answers, pre/post_correct
+        (bool, participants x questions), pre/post_score, delta (post - pre score)
+        and pre/post_question_correct (correct count per question).
+    """
+    return _precompute(engine, os.stat(db_path).st_mtime)
+
+
+# -----------------------------
+# Intent handlers for common questions; each returns a result DataFrame
+# -----------------------------
+def _average_scores(survey):
+    return pd.DataFrame({
+        "avg_pre_score": [survey.pre_score.mean()],
+        "avg_post_score": [survey.post_score.mean()],
+    })
+
+
+def _top_improvement(survey, k):
+    order = np.argsort(-survey.delta, kind="stable")[:k]
+    return pd.DataFrame({
+        "userid": survey.userid[order],
+        "pre_score": survey.pre_score[order],
+        "post_score": survey.post_score[order],
+        "improvement": survey.delta[order],
+    })
+
+
+def _question_average(survey, n, test):
+    if not 1 <= n <= N_QUESTIONS:
+        return None
+    correct = survey.pre_correct if test == "pre" else survey.post_correct
+    return pd.DataFrame({
+        "Question_no": [QUESTION_NOS[n - 1]],
+        "test": [f"{test}-test"],
+        "average_score": [correct[:, n - 1].mean()],
+    })
+
+
+def _count_improved(survey):
+    return pd.DataFrame({"participants_improved": [int((survey.delta > 0).sum())]})
+
+
+def _questions_mostly_correct(survey, test):
+    correct = survey.pre_question_correct if test == "pre" else survey.post_question_correct
+    participants = len(survey.userid)
+    mostly = np.flatnonzero(correct * 2 > participants)
+    mostly = mostly[np.argsort(-correct[mostly], kind="stable")]
+    return pd.DataFrame({
+        "Question_no": [QUESTION_NOS[j] for j in mostly],
+        "correct_count": correct[mostly],
+        "participants": participants,
+    })
+
+
+def _test(text):
+    return "pre" if text.startswith("pre") else "post"
+
+
+# (intent name, pattern, handler call). Named groups in the pattern become
+# placeholders in the call. A pattern must cover the whole question apart from
+# _LEAD_IN and _TRAIL, so a question with any qualifier the handler does not
+# model ("by profession", "among nurses", ...) falls through to SQL generation.
+_TEST = r"(?:the\s+)?{}-?\s?test"
+_INTENT_TEMPLATES = [
+    (
+        "question_average",
+        r"(?:what\s+(?:is|was)\s+|show\s+)?the\s+average\s+score\s+(?:for|on|of)\s+question\s+(?P<n>\d+)"
+        r"\s+(?:in|on)\s+" + _TEST.format(r"(?P<test>pre|post)"),
+        "_question_average(survey, int({n}), _test({test}))",
+    ),
+    (
+        "average_scores",
+        r"(?:what\s+(?:are|were)\s+|show\s+)?the\s+average\s+" + _TEST.format("pre")
+        + r"\s+and\s+" + _TEST.format("post") + r"\s+scores",
+        "_average_scores(survey)",
+    ),
+    (
+        "top_k_improvement",
+        r"(?:which\s+|show\s+(?:the\s+)?|list\s+(?:the\s+)?)(?:top\s+)?(?P<k>\d+)\s+participants\s+"
+        r"(?:showed|had|with)\s+the\s+(?:most|greatest|biggest|largest)\s+improvement"
+        r"(?:\s+from\s+" + _TEST.format("pre") + r"\s+to\s+" + _TEST.format("post") + ")?",
+        "_top_improvement(survey, int({k}))",
+    ),
+    (
+        "count_improved",
+        r"how\s+many\s+participants\s+(?:scored|did)\s+(?:higher|better)\s+on\s+" + _TEST.format("post")
+        + r"(?:\s+than\s+(?:on\s+)?" + _TEST.format("pre") + ")?",
+        "_count_improved(survey)",
+    ),
+    (
+        "questions_mostly_correct",
+        r"which\s+questions\s+were\s+answered\s+correctly\s+by\s+most\s+participants\s+(?:in|on)\s+"
+        + _TEST.format(r"(?P<test>pre|post)"),
+        "_questions_mostly_correct(survey, _test({test}))",
+    ),
+]
+_LEAD_IN = r"(?:(?:please|can\s+you|could\s+you)\s+)?"
+_TRAIL = r"\s*[?.!]*"
+
+_GROUP_RE = re.compile(r"\(\?P<(\w+)>")
+
+
+def _build_intent_dispatch(templates):
+    """
+    Compile all templates into one alternation, to be matched against the
+    whole question, and generate one handler per intent that reads its own
+    match groups directly.
+
+    Returns:
+        tuple: (compiled pattern, {intent name: handler(survey, match)}).
+            The matched intent is the pattern's lastgroup.
+    """
+    alternatives, sources = [], []
+    for name, pattern, call in templates:
+        args = {group: f'm.group("{name}__{group}")' for group in _GROUP_RE.findall(pattern)}
+        pattern = _GROUP_RE.sub(rf"(?P<{name}__\1>", pattern)
+        alternatives.append(f"(?P<{name}>{pattern})")
+        sources.append(f"def {name}(survey, m):\n    return {call.format(**args)}\n")
+    handlers = {}
+    exec("\n".join(sources), globals(), handlers)
+    return re.compile(f"{_LEAD_IN}(?:{'|'.join(alternatives)}){_TRAIL}"), handlers
+
+
+INTENT_RE, INTENT_HANDLERS = _build_intent_dispatch(_INTENT_TEMPLATES)
+
+
+def answer_intent(question: str, engine, db_path: str):
+    """
+    Answer a recognised common question directly from the preloaded answers,
+    without generating SQL.
+
+    Args:
+        question (str): The user's question.
+        engine: SQLAlchemy engine for the survey database.
+        db_path (str): Path of the database file.
+
+    Returns:
+        tuple: (intent_name, result DataFrame) for a recognised question, or None.
+    """
+    m = INTENT_RE.fullmatch(" ".join(question.lower().split()))
+    if m is None:
+        return None
+    result_df = INTENT_HANDLERS[m.lastgroup](precomputed(engine, db_path), m)
+    if result_df is None:
+        return None
+    return m.lastgroup, result_df